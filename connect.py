@@ -1,78 +1,195 @@
+import io
 import logging
 import os
+import re
+import socket
 import time
-from typing import Dict, List, Optional
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional
 from netmiko import ConnectHandler
 import textfsm
-import yaml
 from devices import NetworkDevice
+from settings import PROBE_TIMEOUT, RETRY_ATTEMPTS, RETRY_DELAY, TIMEOUT
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load configuration
-with open('config.yaml', 'r') as f:
-    config = yaml.safe_load(f)
+SSH_PORT = 22
+
+# Show commands gathered from every device. They are sent in a single channel
+# write, each followed by a comment line whose echo marks where its output ends.
+BATCH_COMMANDS = ('show version', 'show inventory', 'show cdp neighbors detail')
+_BATCH_MARKER = '!---CRAWLER-MARK-{}---'
+_BATCH_MARKER_RE = re.compile(r'^.*!---CRAWLER-MARK-\d+---.*$', re.MULTILINE)
+
+# CDP device IDs carry an FQDN and/or "(serial)" suffix; keep what precedes them
+_CDP_ID_RE = re.compile(r'^([^.(]*)')
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+def _read_template(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+# TextFSM template text keyed on (platform prefix, command), read once at import
+_TEMPLATES = {
+    (prefix, command): _read_template(os.path.join(TEMPLATE_DIR, f'{prefix}_{command}.template'))
+    for prefix in ('cisco_ios', 'cisco_nxos')
+    for command in ('show_inventory', 'show_cdp_neighbors_detail')
+}
+
+# show version is a single record, so it is read with one precompiled pattern
+# per field rather than a TextFSM state machine
+_VERSION_PATTERNS = {
+    'cisco_ios': {
+        'platform': re.compile(r'^[Cc]isco\s+(\S+)\s+\(.*\)\s+processor', re.MULTILINE),
+        'version': re.compile(r'^.*Software.*?,\s+Version\s+([^\s,]+)', re.MULTILINE),
+        'uptime': re.compile(r'^\S+\s+uptime\s+is\s+(.+)$', re.MULTILINE),
+        'serial': re.compile(r'^\s*Processor\s+board\s+ID\s+(\S+)', re.MULTILINE)
+    },
+    'cisco_nxos': {
+        'platform': re.compile(r'^\s*cisco\s+(?:Nexus\s*\S*\s+)?(\S+)\s+[Cc]hassis', re.MULTILINE),
+        'version': re.compile(r'^\s*(?:NXOS|system):\s+version\s+(\S+)', re.MULTILINE),
+        'uptime': re.compile(r'^Kernel\s+uptime\s+is\s+(.+)$', re.MULTILINE),
+        'serial': re.compile(r'^\s*Processor\s+[Bb]oard\s+ID\s+(\S+)', re.MULTILINE)
+    }
+}
+
+def _load_template(template_prefix: str, template_name: str) -> textfsm.TextFSM:
+    """Build a fresh TextFSM parser for a platform's command template"""
+    # ParseText mutates parser state, so each call gets its own FSM
+    return textfsm.TextFSM(io.StringIO(_TEMPLATES[(template_prefix, template_name)]))
+
+def _parse_show_version(output: str, template_prefix: str, hostname: str) -> Dict:
+    """Parse show version output using precompiled field patterns"""
+    result = {}
+    for field, pattern in _VERSION_PATTERNS[template_prefix].items():
+        match = pattern.search(output)
+        result[field] = match.group(1).strip() if match else ''
+
+    if not any(result.values()):
+        logger.warning(f"No data parsed from show version output for {hostname}")
+        return {}
+
+    return result
+
+def _parse_show_inventory(output: str, template_prefix: str, hostname: str) -> Dict:
+    """Parse show inventory output using TextFSM"""
+    try:
+        template = _load_template(template_prefix, 'show_inventory')
+        results = template.ParseTextToDicts(output)
+
+        if not results:
+            logger.warning(f"No data parsed from show inventory output for {hostname}")
+            return {}
+
+        # Find the chassis entry (usually first entry)
+        for result in results:
+            if 'chassis' in result.get('NAME', '').lower():
+                return {
+                    'serial_number': result.get('SN', ''),
+                    'part_number': result.get('PID', ''),
+                    'description': result.get('DESCR', '')
+                }
+
+        return {}
+
+    except Exception as e:
+        logger.error(f"Error parsing show inventory output for {hostname}: {str(e)}")
+        return {}
+
+def _parse_cdp_neighbors(output: str, template_prefix: str, hostname: str) -> List[Dict]:
+    """Parse CDP neighbors detail output using TextFSM"""
+    try:
+        template = _load_template(template_prefix, 'show_cdp_neighbors_detail')
+        results = template.ParseTextToDicts(output)
+
+        if not results:
+            logger.warning(f"No data parsed from CDP neighbors output for {hostname}")
+            return []
+
+        neighbors = []
+        for result in results:
+            # Only include neighbors with management IPs
+            management_ip = result.get('MANAGEMENT_IP')
+            if management_ip:
+                # Clean the device ID to remove FQDN and serial numbers
+                device_id = _CDP_ID_RE.match(result['DEVICE_ID']).group(1).strip()
+
+                neighbors.append({
+                    'hostname': device_id,
+                    'platform': result.get('PLATFORM', ''),
+                    'ip_address': management_ip,
+                    'local_interface': result.get('LOCAL_INTERFACE', ''),
+                    'remote_interface': result.get('PORT_ID', ''),
+                    'capabilities': result.get('CAPABILITY', '')
+                })
+
+        return neighbors
+
+    except Exception as e:
+        logger.error(f"Error parsing CDP neighbors output for {hostname}: {str(e)}")
+        return []
 
 class DeviceConnection:
-    def __init__(self, device: NetworkDevice, username: str, password: str):
+    def __init__(self, device: NetworkDevice, username: str, password: str,
+                 parse_pool: Optional[Executor] = None):
         self.device = device
         self.username = username
         self.password = password
         self.connection = None
-        self.template_dir = os.path.join(os.path.dirname(__file__), 'templates')
+        # TextFSM parsing holds the GIL, so it can be handed to a process pool
+        self.parse_pool = parse_pool
+        self._template_prefix = 'cisco_ios'
         
-    def _load_template(self, template_name: str) -> textfsm.TextFSM:
-        """Load a TextFSM template"""
-        # Determine the correct template prefix based on device type
-        if 'nx-os' in self.device.platform.lower():
-            template_prefix = 'cisco_nxos'
-        else:
-            template_prefix = 'cisco_ios'
-            
-        template_path = os.path.join(self.template_dir, f'{template_prefix}_{template_name}')
-        try:
-            with open(template_path) as f:
-                return textfsm.TextFSM(f)
-        except Exception as e:
-            logger.error(f"Error loading template {template_path}: {str(e)}")
-            raise
+    def _run_parser(self, parser: Callable, output: str):
+        """Run a TextFSM parser in the parse pool if there is one, otherwise inline"""
+        if self.parse_pool is None:
+            return parser(output, self._template_prefix, self.device.hostname)
+        return self.parse_pool.submit(parser, output, self._template_prefix, self.device.hostname).result()
+        
+    def _probe(self, host: str) -> None:
+        """Raise OSError quickly if nothing is listening on the SSH port"""
+        with socket.create_connection((host, SSH_PORT), timeout=PROBE_TIMEOUT):
+            pass
             
     def connect(self) -> bool:
         """Establish connection to the device with retry logic"""
-        for attempt in range(config['connection']['retry_attempts']):
+        # Try cleaned hostname first, then the IP if it's different
+        hosts = [self.device.hostname]
+        if self.device.ip_address and self.device.ip_address != self.device.hostname:
+            hosts.append(self.device.ip_address)
+            
+        last_attempt = RETRY_ATTEMPTS - 1
+        for attempt in range(RETRY_ATTEMPTS):
             try:
                 device_params = {
-                    'device_type': 'cisco_ios',  # Default, will be updated after show version
+                    'device_type': 'cisco_ios',
                     'username': self.username,
                     'password': self.password,
-                    'timeout': config['connection']['timeout'],
+                    'timeout': TIMEOUT,
                     'fast_cli': True
                 }
                 
-                # Try cleaned hostname first
-                device_params['host'] = self.device.hostname
-                try:
-                    logger.info(f"Attempting connection to {self.device.hostname}")
-                    self.connection = ConnectHandler(**device_params)
-                    return True
-                except Exception as e:
-                    logger.warning(f"Failed to connect via hostname {self.device.hostname}: {str(e)}")
-                    
-                    # Only try IP if it's different from hostname
-                    if self.device.ip_address != self.device.hostname:
-                        logger.info(f"Falling back to IP {self.device.ip_address}")
-                        device_params['host'] = self.device.ip_address
+                for host in hosts:
+                    device_params['host'] = host
+                    try:
+                        # Re-probed on every attempt so a lost SYN doesn't rule a host out
+                        self._probe(host)
+                        if logger.isEnabledFor(logging.INFO):
+                            logger.info(f"Attempting connection to {host}")
                         self.connection = ConnectHandler(**device_params)
                         return True
-                    else:
-                        raise  # Re-raise if hostname and IP are the same
+                    except Exception as e:
+                        if host == hosts[-1]:
+                            raise  # Re-raise if there is nothing left to fall back to
+                        logger.warning(f"Failed to connect via {host}: {str(e)}")
+                        if logger.isEnabledFor(logging.INFO):
+                            logger.info(f"Falling back to {hosts[-1]}")
                         
             except Exception as e:
-                if attempt < config['connection']['retry_attempts'] - 1:
+                if attempt < last_attempt:
                     logger.warning(f"Connection attempt {attempt + 1} failed: {str(e)}")
-                    time.sleep(config['connection']['retry_delay'])
+                    time.sleep(RETRY_DELAY)
                 else:
                     logger.error(f"Failed to connect to {self.device.hostname} ({self.device.ip_address}): {str(e)}")
                     return False
@@ -85,20 +202,34 @@ class DeviceConnection:
             except Exception as e:
                 logger.error(f"Error disconnecting from {self.device.hostname}: {str(e)}")
                 
-    def execute_command(self, command: str) -> Optional[str]:
-        """Execute a command and return the output with retry logic"""
+    def execute_commands(self, commands: List[str]) -> Optional[List[str]]:
+        """Execute several commands in one round trip and return each command's output"""
         if not self.connection:
             return None
             
-        for attempt in range(config['connection']['retry_attempts']):
+        batch = '\n'.join(f"{command}\n{_BATCH_MARKER.format(i)}" for i, command in enumerate(commands))
+        end_marker = re.escape(_BATCH_MARKER.format(len(commands) - 1))
+        
+        last_attempt = RETRY_ATTEMPTS - 1
+        for attempt in range(RETRY_ATTEMPTS):
             try:
-                return self.connection.send_command(command)
+                # Paging and the prompt were already handled at session setup, so
+                # skip send_command's per-call prompt discovery and read to the marker
+                if attempt:
+                    self.connection.clear_buffer()
+                self.connection.write_channel(self.connection.normalize_cmd(batch))
+                output = self.connection.read_until_pattern(pattern=end_marker, read_timeout=TIMEOUT)
+                chunks = [chunk.strip() for chunk in _BATCH_MARKER_RE.split(output)]
+                if len(chunks) < len(commands):
+                    logger.warning(f"Batched output from {self.device.hostname} is missing command markers")
+                    chunks.extend([''] * (len(commands) - len(chunks)))
+                return chunks[:len(commands)]
             except Exception as e:
-                if attempt < config['connection']['retry_attempts'] - 1:
-                    logger.warning(f"Command '{command}' attempt {attempt + 1} failed: {str(e)}")
-                    time.sleep(config['connection']['retry_delay'])
+                if attempt < last_attempt:
+                    logger.warning(f"Batched commands attempt {attempt + 1} failed: {str(e)}")
+                    time.sleep(RETRY_DELAY)
                 else:
-                    logger.error(f"Error executing command '{command}' on {self.device.hostname}: {str(e)}")
+                    logger.error(f"Error executing batched commands on {self.device.hostname}: {str(e)}")
                     return None
                     
     def process_device(self) -> bool:
@@ -107,33 +238,30 @@ class DeviceConnection:
             return False
             
         try:
-            # Get show version output
-            version_output = self.execute_command('show version')
+            # Collect all show command output in a single round trip
+            outputs = self.execute_commands(BATCH_COMMANDS)
+            if not outputs:
+                return False
+            version_output, inventory_output, cdp_output = outputs
             if not version_output:
                 return False
                 
+            # NX-OS and IOS need different templates; pick them once per device
+            if 'NX-OS' in version_output:
+                self._template_prefix = 'cisco_nxos'
+                
             # Parse version output and update device type
-            version_data = self._parse_show_version(version_output)
+            version_data = _parse_show_version(version_output, self._template_prefix, self.device.hostname)
             self.device.update_from_show_version(version_data)
             
-            # Update device type for connection
-            if 'nx-os' in self.device.platform.lower():
-                self.connection.device_type = 'cisco_nxos'
-            elif 'iosxe' in self.device.platform.lower():
-                self.connection.device_type = 'cisco_xe'
-            else:
-                self.connection.device_type = 'cisco_ios'
-                
-            # Get show inventory output
-            inventory_output = self.execute_command('show inventory')
+            # Parse show inventory output
             if inventory_output:
-                inventory_data = self._parse_show_inventory(inventory_output)
+                inventory_data = self._run_parser(_parse_show_inventory, inventory_output)
                 self.device.update_from_show_inventory(inventory_data)
                 
-            # Get CDP neighbors and update device with management IP if available
-            cdp_output = self.execute_command('show cdp neighbors detail')
+            # Parse CDP neighbors and update device with management IP if available
             if cdp_output:
-                cdp_data = self._parse_cdp_neighbors(cdp_output)
+                cdp_data = self._run_parser(_parse_cdp_neighbors, cdp_output)
                 self.device.update_from_cdp_neighbors(cdp_data)
                 
                 # If we don't have an IP address yet, try to get it from CDP
@@ -142,7 +270,8 @@ class DeviceConnection:
                     for neighbor in cdp_data:
                         if neighbor['hostname'].lower() == self.device.hostname.lower():
                             self.device.ip_address = neighbor['ip_address']
-                            logger.info(f"Updated device IP from CDP: {self.device.ip_address}")
+                            if logger.isEnabledFor(logging.INFO):
+                                logger.info(f"Updated device IP from CDP: {self.device.ip_address}")
                             break
                 
             return True
@@ -152,84 +281,3 @@ class DeviceConnection:
             return False
         finally:
             self.disconnect()
-            
-    def _parse_show_version(self, output: str) -> Dict:
-        """Parse show version output using TextFSM"""
-        try:
-            template = self._load_template('cisco_ios_show_version.template')
-            results = template.ParseText(output)
-            
-            if not results:
-                logger.warning(f"No data parsed from show version output for {self.device.hostname}")
-                return {}
-                
-            # Get the first (and should be only) record
-            result = results[0]
-            
-            return {
-                'platform': result.get('PLATFORM', ''),
-                'version': result.get('VERSION', ''),
-                'uptime': result.get('UPTIME', ''),
-                'serial': result.get('SERIAL', '')
-            }
-            
-        except Exception as e:
-            logger.error(f"Error parsing show version output for {self.device.hostname}: {str(e)}")
-            return {}
-            
-    def _parse_show_inventory(self, output: str) -> Dict:
-        """Parse show inventory output using TextFSM"""
-        try:
-            template = self._load_template('cisco_ios_show_inventory.template')
-            results = template.ParseText(output)
-            
-            if not results:
-                logger.warning(f"No data parsed from show inventory output for {self.device.hostname}")
-                return {}
-                
-            # Find the chassis entry (usually first entry)
-            for result in results:
-                if 'chassis' in result.get('NAME', '').lower():
-                    return {
-                        'serial_number': result.get('SN', ''),
-                        'part_number': result.get('PID', ''),
-                        'description': result.get('DESCR', '')
-                    }
-                    
-            return {}
-            
-        except Exception as e:
-            logger.error(f"Error parsing show inventory output for {self.device.hostname}: {str(e)}")
-            return {}
-            
-    def _parse_cdp_neighbors(self, output: str) -> List[Dict]:
-        """Parse CDP neighbors detail output using TextFSM"""
-        try:
-            template = self._load_template('cisco_ios_show_cdp_neighbors_detail.template')
-            results = template.ParseText(output)
-            
-            if not results:
-                logger.warning(f"No data parsed from CDP neighbors output for {self.device.hostname}")
-                return []
-                
-            neighbors = []
-            for result in results:
-                # Only include neighbors with management IPs
-                if result.get('MANAGEMENT_IP'):
-                    # Clean the device ID to remove FQDN and serial numbers
-                    device_id = result['DEVICE_ID'].split('.')[0].split('(')[0].strip()
-                    
-                    neighbors.append({
-                        'hostname': device_id,
-                        'platform': result.get('PLATFORM', ''),
-                        'ip_address': result.get('MANAGEMENT_IP', ''),
-                        'local_interface': result.get('LOCAL_INTERFACE', ''),
-                        'remote_interface': result.get('PORT_ID', ''),
-                        'capabilities': result.get('CAPABILITY', '')
-                    })
-                    
-            return neighbors
-            
-        except Exception as e:
-            logger.error(f"Error parsing CDP neighbors output for {self.device.hostname}: {str(e)}")
-            return [] 
\ No newline at end of file
@@ -1,149 +1,349 @@
+import csv
+import ipaddress
 import logging
+import multiprocessing
+import os
+import socket
 import threading
 import queue
 import time
-from typing import List, Dict
-import yaml
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Set, Tuple
 from devices import NetworkDevice
 from connect import DeviceConnection
-from data import DatabaseManager
-from datetime import datetime, timedelta
+from sqlalchemy import select
+from data import DatabaseManager, Device
+from settings import config, MAX_WORKERS, PARSE_PROCESSES, QUEUED_PER_WORKER, QUEUE_TIMEOUT
+from datetime import timedelta
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load configuration
-with open('config.yaml', 'r') as f:
-    config = yaml.safe_load(f)
+def _is_crawlable_ip(ip_address: str) -> bool:
+    """Check that a CDP management address is a usable IPv4 address"""
+    try:
+        socket.inet_aton(ip_address)
+        address = ipaddress.ip_address(ip_address)
+    except (OSError, ValueError):
+        return False
+    return not (address.is_loopback or address.is_link_local)
 
+# How long the dispatcher waits before polling again when nothing is pending
+_DISPATCH_POLL_INTERVAL = 0.5  # seconds
+
+# Most pending devices the dispatcher claims in one statement
+_CLAIM_BATCH_SIZE = 32
+
+# Most worker results the writer thread records in one transaction
+_RESULT_BATCH_SIZE = 64
+
+class _Counter:
+    """Thread-safe counter with its own lock, so workers don't share stats_lock"""
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+        
+    def increment(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+            
+    def decrement(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value -= amount
+            
+    @property
+    def value(self) -> int:
+        with self._lock:
+            return self._value
+            
 class NetworkCrawler:
-    def __init__(self, username: str, password: str):
+    def __init__(self, username: str, password: str, num_workers: int = None):
         self.username = username
         self.password = password
-        self.db = DatabaseManager()
+        self.num_workers = num_workers or MAX_WORKERS
+        # Workers never touch the database; only the dispatcher, the result
+        # writer and the main thread do, so they get one reader connection each
+        self.db = DatabaseManager(pool_size=3)
+        # CPU-bound TextFSM parsing runs in separate processes to sidestep the GIL.
+        # Workers are spawned, not forked, since the crawler is multi-threaded.
+        self._parse_pool = ProcessPoolExecutor(
+            max_workers=PARSE_PROCESSES or os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        # Claimed devices handed from the dispatcher to the workers. The dispatcher
+        # takes a slot per device it claims and workers free it on get(), so only a
+        # few devices per worker are claimed ahead and the rest wait in the database.
         self.work_queue = queue.Queue()
+        self._slots = threading.Semaphore(max(1, self.num_workers * QUEUED_PER_WORKER))
+        # Devices claimed but not yet committed by the writer; zero means no worker
+        # can still be adding neighbors
+        self._in_flight = _Counter()
+        # Set by the writer after each commit, waking the dispatcher to look for new work
+        self._work_changed = threading.Event()
+        # Finished devices handed from the workers to the single writer thread
+        self.result_queue = queue.Queue()
         self.threads = []
+        self.writer_thread = None
         self.stop_event = threading.Event()
+        self.crawl_complete = threading.Event()
         self.stats = {
-            'start_time': datetime.now(),
-            'devices_processed': 0,
-            'devices_discovered': 0,
-            'processing_rate': 0,
+            'start_time': time.monotonic(),
+            'devices_processed': _Counter(),
+            'devices_discovered': _Counter(),
             'active_devices': set(),
-            'last_report_time': datetime.now()
+            'last_report_time': time.monotonic()
         }
+        # Guards the active device set; each counter has its own lock
+        self.active_lock = threading.Lock()
+        # Serializes progress reports
         self.stats_lock = threading.Lock()
+        # (lower-cased hostname, ip_address) pairs already known to the database
+        self._seen: Set[Tuple[str, str]] = set()
+        self._seen_lock = threading.Lock()
         
+    def _add_seen(self, hostname: str, ip_address: str) -> bool:
+        """Record a device as known to the database, returning False if it already was"""
+        # Check and add under one lock so concurrent discoveries can't both enqueue it
+        key = (hostname.lower(), ip_address)
+        with self._seen_lock:
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+            return True
+            
     def _update_stats(self, device_processed: bool = False, device_discovered: bool = False,
                      active_device: str = None, remove_active: bool = False) -> None:
         """Update crawler statistics in a thread-safe manner"""
-        with self.stats_lock:
-            if device_processed:
-                self.stats['devices_processed'] += 1
-            if device_discovered:
-                self.stats['devices_discovered'] += 1
-            if active_device:
+        if device_processed:
+            self.stats['devices_processed'].increment()
+        if device_discovered:
+            self.stats['devices_discovered'].increment()
+        if active_device:
+            with self.active_lock:
                 if remove_active:
                     self.stats['active_devices'].discard(active_device)
                 else:
                     self.stats['active_devices'].add(active_device)
                     
-            # Calculate processing rate (devices per minute)
-            elapsed_minutes = (datetime.now() - self.stats['start_time']).total_seconds() / 60
-            if elapsed_minutes > 0:
-                self.stats['processing_rate'] = self.stats['devices_processed'] / elapsed_minutes
-                
     def _report_progress(self) -> None:
         """Report current progress and statistics"""
+        # Cheap unlocked check so the lock and the pending count are only taken when a report is due
+        if time.monotonic() - self.stats['last_report_time'] < 30:
+            return
+            
+        # Nothing to build the report for when INFO is filtered out
+        if not logger.isEnabledFor(logging.INFO):
+            return
+            
         with self.stats_lock:
-            now = datetime.now()
-            if (now - self.stats['last_report_time']).total_seconds() >= 30:  # Report every 30 seconds
-                elapsed = now - self.stats['start_time']
+            now = time.monotonic()
+            if now - self.stats['last_report_time'] >= 30:  # Report every 30 seconds
+                elapsed_seconds = now - self.stats['start_time']
+                devices_processed = self.stats['devices_processed'].value
+                
+                # Calculate processing rate (devices per minute)
+                elapsed_minutes = elapsed_seconds / 60.0
+                processing_rate = devices_processed / elapsed_minutes if elapsed_minutes > 0 else 0
+                
+                with self.active_lock:
+                    active_devices = list(self.stats['active_devices'])
+                    
+                # Pending devices wait in the database, not in the small in-memory buffer
+                try:
+                    with self.db.session_scope() as session:
+                        pending = self.db.count_pending(session)
+                except Exception as e:
+                    logger.error(f"Error counting pending devices: {str(e)}")
+                    pending = 'unknown'
+                    
                 logger.info(f"\nCrawler Progress Report:")
-                logger.info(f"Running for: {str(elapsed).split('.')[0]}")
-                logger.info(f"Devices discovered: {self.stats['devices_discovered']}")
-                logger.info(f"Devices processed: {self.stats['devices_processed']}")
-                logger.info(f"Processing rate: {self.stats['processing_rate']:.2f} devices/minute")
-                logger.info(f"Active devices: {len(self.stats['active_devices'])}")
-                logger.info(f"Queue size: {self.work_queue.qsize()}")
-                if self.stats['active_devices']:
-                    logger.info(f"Currently processing: {', '.join(self.stats['active_devices'])}")
+                logger.info(f"Running for: {str(timedelta(seconds=int(elapsed_seconds)))}")
+                logger.info(f"Devices discovered: {self.stats['devices_discovered'].value}")
+                logger.info(f"Devices processed: {devices_processed}")
+                logger.info(f"Processing rate: {processing_rate:.2f} devices/minute")
+                logger.info(f"Active devices: {len(active_devices)}")
+                logger.info(f"Queue size: {pending}")
+                if active_devices:
+                    logger.info(f"Currently processing: {', '.join(active_devices)}")
                 self.stats['last_report_time'] = now
                 
     def add_seed_device(self, hostname: str, ip_address: str) -> None:
         """Add a seed device to start the crawl"""
-        session = self.db.get_session()
-        try:
-            if not self.db.device_exists(session, hostname, ip_address):
-                self.db.add_to_queue(session, hostname, ip_address)
-                self.work_queue.put((hostname, ip_address))
-                self._update_stats(device_discovered=True)
-        finally:
-            session.close()
+        if not self._add_seen(hostname, ip_address):
+            return
             
+        with self.db.session_scope() as session:
+            is_new = self.db.add_to_queue(session, hostname, ip_address)
+        if is_new:
+            self._update_stats(device_discovered=True)
+            
+    def _acquire_slots(self) -> int:
+        """Block until the work queue has room, returning how many slots were taken (0 on stop)"""
+        # Wait for one slot while checking for stop, then take any others already free.
+        # Progress is reported from here since workers no longer touch the database.
+        while not self._slots.acquire(timeout=_DISPATCH_POLL_INTERVAL):
+            if self.stop_event.is_set():
+                return 0
+            self._report_progress()
+        slots = 1
+        while slots < _CLAIM_BATCH_SIZE and self._slots.acquire(blocking=False):
+            slots += 1
+        return slots
+        
+    def dispatcher(self) -> None:
+        """Dispatcher thread that claims pending devices from the database for the workers"""
+        while not self.stop_event.is_set():
+            self._report_progress()
+            slots = self._acquire_slots()
+            if not slots:
+                return
+                
+            claimed = []
+            try:
+                # Cleared before looking, so a commit that lands after this wakes the wait below
+                self._work_changed.clear()
+                # With nothing in flight no worker can still be adding neighbors,
+                # so finding nothing to claim after this point ends the crawl
+                idle = self._in_flight.value == 0
+                # Claim no more rows than slots taken, so a claimed row is never
+                # held outside the queue
+                with self.db.session_scope() as session:
+                    claimed = self.db.claim_next_devices(session, slots)
+            except Exception as e:
+                logger.error(f"Error in dispatcher thread: {str(e)}")
+                self.stop_event.wait(_DISPATCH_POLL_INTERVAL)
+                continue
+            finally:
+                # Hand back the slots no claimed row filled
+                for _ in range(slots - len(claimed)):
+                    self._slots.release()
+                    
+            if not claimed:
+                if idle:
+                    self.crawl_complete.set()
+                    return
+                self._work_changed.wait(_DISPATCH_POLL_INTERVAL)
+                continue
+                
+            self._in_flight.increment(len(claimed))
+            for device in claimed:
+                self.work_queue.put_nowait(tuple(device))
+                
     def worker(self) -> None:
         """Worker thread that processes devices from the queue"""
-        session = self.db.get_session()
-        try:
-            while not self.stop_event.is_set():
-                try:
-                    hostname, ip_address = self.work_queue.get(timeout=config['threading']['queue_timeout'])
-                    
-                    # Check if device is already being processed or processed
-                    if self.db.device_exists(session, hostname, ip_address):
-                        self.work_queue.task_done()
-                        continue
-                        
-                    # Mark device as processing
-                    self.db.mark_processing(session, hostname)
-                    self._update_stats(active_device=hostname)
-                    
-                    # Create and process device
-                    device = NetworkDevice(hostname, ip_address)
-                    connection = DeviceConnection(device, self.username, self.password)
-                    
-                    if connection.process_device():
-                        # Add device to database
-                        self.db.add_device(session, device.to_dict())
-                        self._update_stats(device_processed=True)
-                        
-                        # Add neighbors to queue
-                        for neighbor in device.get_cdp_neighbors():
-                            if not self.db.device_exists(session, neighbor['hostname'], neighbor['ip_address']):
-                                self.db.add_to_queue(session, neighbor['hostname'], neighbor['ip_address'])
-                                self.work_queue.put((neighbor['hostname'], neighbor['ip_address']))
-                                self._update_stats(device_discovered=True)
-                                
-                    # Mark device as processed
-                    self.db.mark_processed(session, hostname)
-                    self._update_stats(active_device=hostname, remove_active=True)
-                    
-                    # Report progress
-                    self._report_progress()
+        while not self.stop_event.is_set():
+            try:
+                queue_id, hostname, ip_address = self.work_queue.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                continue
+            self._slots.release()
+            
+            device_data = None
+            candidates = []
+            try:
+                self._update_stats(active_device=hostname)
+                
+                # Create and process device
+                device = NetworkDevice(hostname, ip_address)
+                connection = DeviceConnection(device, self.username, self.password, self._parse_pool)
+                if connection.process_device():
+                    device_data = device.to_dict()
+                    candidates = self._neighbor_candidates(device)
+                    self._update_stats(device_processed=True)
                     
+            except Exception as e:
+                logger.error(f"Error in worker thread: {str(e)}")
+            finally:
+                # The writer counts the device finished once the result is committed
+                self.result_queue.put((queue_id, hostname, device_data, candidates))
+                self._update_stats(active_device=hostname, remove_active=True)
+                
+    def _neighbor_candidates(self, device: NetworkDevice) -> List[Tuple[str, str]]:
+        """Return the CDP neighbors of a device that may still need to be queued"""
+        candidates = []
+        for neighbor in device.get_cdp_neighbors():
+            # Skip the database for devices already seen
+            key = (neighbor['hostname'], neighbor['ip_address'])
+            if not self._add_seen(*key):
+                continue
+            # A bad address would burn a full connect retry cycle later
+            if not _is_crawlable_ip(neighbor['ip_address']):
+                logger.warning(f"Skipping neighbor {neighbor['hostname']} with unusable IP {neighbor['ip_address']}")
+                continue
+            candidates.append(key)
+        return candidates
+        
+    def _record_results(self, session, results) -> int:
+        """Record a batch of worker results, returning the number of neighbors queued"""
+        discovered = 0
+        for _, _, device_data, candidates in results:
+            if device_data is not None:
+                self.db.add_device(session, device_data)
+                # Neighbors already in the queue are skipped by the insert itself
+                discovered += len(self.db.add_to_queue_bulk(session, candidates))
+        self.db.mark_processed_bulk(session, [result[0] for result in results])
+        return discovered
+        
+    def result_writer(self) -> None:
+        """Writer thread that records worker results, many devices per commit"""
+        while True:
+            # Block for one result, then take whatever else is already waiting
+            batch = [self.result_queue.get()]
+            while len(batch) < _RESULT_BATCH_SIZE:
+                try:
+                    batch.append(self.result_queue.get_nowait())
                 except queue.Empty:
-                    continue
-                except Exception as e:
-                    logger.error(f"Error in worker thread: {str(e)}")
-                finally:
-                    self.work_queue.task_done()
+                    break
                     
-        finally:
-            session.close()
+            # None is the shutdown sentinel, queued after every worker has exited
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+                
+            discovered = 0
+            try:
+                with self.db.session_scope() as session:
+                    discovered = self._record_results(session, batch)
+            except Exception as e:
+                logger.error(f"Error recording batch of {len(batch)} devices: {str(e)}")
+                # Retry one device per transaction so a single bad row can't lose the batch
+                discovered = 0
+                for result in batch:
+                    try:
+                        with self.db.session_scope() as session:
+                            discovered += self._record_results(session, [result])
+                    except Exception as e:
+                        logger.error(f"Error recording device {result[1]}: {str(e)}")
+                        
+            for _ in range(discovered):
+                self._update_stats(device_discovered=True)
+            # Neighbors are committed now, so the dispatcher may see these as finished
+            self._in_flight.decrement(len(batch))
+            self._work_changed.set()
             
+            if done:
+                return
+                
     def start(self, num_workers: int = None) -> None:
         """Start the crawler with specified number of worker threads"""
         if num_workers is None:
-            num_workers = config['threading']['max_workers']
+            num_workers = self.num_workers
             
-        # Start worker threads
+        # Start the dispatcher and worker threads
+        thread = threading.Thread(target=self.dispatcher)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+        
         for _ in range(num_workers):
             thread = threading.Thread(target=self.worker)
             thread.daemon = True
             thread.start()
             self.threads.append(thread)
             
+        self.writer_thread = threading.Thread(target=self.result_writer)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+        
         logger.info(f"Started crawler with {num_workers} worker threads")
         
     def stop(self) -> None:
@@ -154,20 +354,47 @@ class NetworkCrawler:
         for thread in self.threads:
             thread.join()
             
+        # Let the writer drain the results the workers left behind
+        if self.writer_thread is not None:
+            self.result_queue.put(None)
+            self.writer_thread.join()
+        self._parse_pool.shutdown()
+        
+        # Devices still waiting in the work queue were claimed but never crawled;
+        # hand them back so a restarted crawl claims them again
+        unclaimed = []
+        while True:
+            try:
+                unclaimed.append(self.work_queue.get_nowait()[0])
+            except queue.Empty:
+                break
+        if unclaimed:
+            try:
+                with self.db.session_scope() as session:
+                    self.db.release_claims(session, unclaimed)
+            except Exception as e:
+                logger.error(f"Error releasing {len(unclaimed)} claimed devices: {str(e)}")
+            
         # Final progress report
         self._report_progress()
         logger.info("Crawler stopped")
         
     def wait_for_completion(self) -> None:
-        """Wait for all queued work to be completed"""
-        self.work_queue.join()
+        """Wait until the dispatcher finds no pending devices and no work in flight"""
+        self.crawl_complete.wait()
         
     def export_inventory(self) -> None:
         """Export device inventory to CSV"""
-        session = self.db.get_session()
-        try:
-            devices = session.query(Device).all()
-            
+        # Stream plain column tuples rather than loading every Device object
+        query = select(
+            Device.hostname,
+            Device.ip_address,
+            Device.platform,
+            Device.serial_number,
+            Device.device_type
+        ).execution_options(yield_per=1000)
+        
+        with self.db.session_scope() as session:
             # Create output directory if it doesn't exist
             output_dir = config['output']['directory']
             if not os.path.exists(output_dir):
@@ -175,16 +402,9 @@ class NetworkCrawler:
                 
             # Write to CSV
             output_file = os.path.join(output_dir, config['output']['inventory_file'])
-            with open(output_file, 'w') as f:
-                # Write header
-                f.write("hostname,ip_address,platform,serial_number,device_type\n")
+            with open(output_file, 'w', newline='', buffering=1 << 20) as f:
+                writer = csv.writer(f)
+                writer.writerow(['hostname', 'ip_address', 'platform', 'serial_number', 'device_type'])
+                writer.writerows(session.execute(query))
                 
-                # Write device data
-                for device in devices:
-                    f.write(f"{device.hostname},{device.ip_address},{device.platform},"
-                           f"{device.serial_number},{device.device_type}\n")
-                           
-            logger.info(f"Inventory exported to {output_file}")
-            
-        finally:
-            session.close() 
\ No newline at end of file
+        logger.info(f"Inventory exported to {output_file}")
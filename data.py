@@ -1,19 +1,17 @@
-import os
 import logging
+from contextlib import contextmanager
 from datetime import datetime
-from sqlalchemy import create_engine, Column, String, Boolean, DateTime, Integer, ForeignKey
+from sqlalchemy import (create_engine, event, false, func, select, text, update,
+                        Column, Index, String, Boolean, DateTime, Integer)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-import yaml
+from sqlalchemy.orm import scoped_session, sessionmaker, Session
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from settings import config
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load configuration
-with open('config.yaml', 'r') as f:
-    config = yaml.safe_load(f)
-
 Base = declarative_base()
 
 class Device(Base):
@@ -42,75 +40,167 @@ class Queue(Base):
     added_at = Column(DateTime, default=datetime.utcnow)
     processed_at = Column(DateTime)
 
+# Partial index holding only claimable rows, so the dispatcher's claim never
+# scans processed history. hostname/ip_address lookups already use the unique indexes.
+Index(
+    'ix_queue_pending',
+    Queue.is_processed,
+    Queue.is_processing,
+    sqlite_where=text('is_processed = 0 AND is_processing = 0')
+)
+
+class RoutingSession(Session):
+    """Session that sends writes to a single writer connection and reads to a pool"""
+    def __init__(self, *args, reader=None, writer=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reader = reader
+        self.writer = writer
+        self.writing = False
+        
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        # Once a transaction has written, stay on the writer so it reads its own changes
+        if self.writing or isinstance(clause, UpdateBase):
+            self.writing = True
+            return self.writer
+        return self.reader
+        
+@event.listens_for(RoutingSession, 'before_flush')
+def _route_flush(session, flush_context, instances):
+    # A flush always writes, so everything it emits goes to the writer
+    session.writing = True
+    
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _reset_routing(session, transaction):
+    if transaction.parent is None:
+        session.writing = False
+        
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, pool_size=5):
+        # N readers share a pool; all writes go through one connection so they
+        # queue in Python instead of contending for SQLite's write lock
+        self.engine = self._create_engine(pool_size)
+        self.writer_engine = self._create_engine(1)
+        Base.metadata.create_all(self.writer_engine)
+        # create_all skips indexes on tables that already exist
+        for index in Queue.__table__.indexes:
+            index.create(self.writer_engine, checkfirst=True)
+        # One session per thread, reused across units of work; closing it at the
+        # end of each unit still hands its connections back to the pools
+        self.Session = scoped_session(
+            sessionmaker(class_=RoutingSession, reader=self.engine, writer=self.writer_engine)
+        )
+        
+        # Built once against the table rather than the mapped class, so queueing
+        # skips the ORM bulk insert machinery. The unique hostname and ip_address
+        # constraints do the existence check inside SQLite; RETURNING reports
+        # only the rows actually inserted.
+        queue_table = Queue.__table__
+        self._queue_insert = (
+            sqlite_insert(queue_table)
+            .on_conflict_do_nothing()
+            .returning(queue_table.c.hostname, queue_table.c.ip_address)
+        )
+        
+    def _create_engine(self, pool_size):
         db_path = config['database']['path']
-        self.engine = create_engine(f'sqlite:///{db_path}', 
-                                  connect_args={'timeout': 30})
-        Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
+        engine = create_engine(f'sqlite:///{db_path}',
+                               connect_args={'timeout': 30},
+                               poolclass=QueuePool,
+                               pool_size=pool_size,
+                               max_overflow=0)
+        event.listen(engine, 'connect', self._configure_connection)
+        return engine
         
+    @staticmethod
+    def _configure_connection(dbapi_connection, connection_record):
+        """Tune each new SQLite connection for many small concurrent commits"""
+        cursor = dbapi_connection.cursor()
+        try:
+            # WAL lets readers run alongside the writer; NORMAL only fsyncs at checkpoints
+            cursor.execute(f"PRAGMA journal_mode={config['database']['journal_mode']}")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA cache_size=-64000")  # 64MB
+            cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+            cursor.execute("PRAGMA busy_timeout=30000")
+        finally:
+            cursor.close()
+            
     def get_session(self):
         return self.Session()
     
+    @contextmanager
+    def session_scope(self):
+        """Provide a session for one unit of work, committing on success"""
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
     def add_device(self, session, device_data):
-        """Add a new device to the database"""
+        """Add a new device to the database (committed by the caller)"""
         device = Device(**device_data)
         session.add(device)
-        session.commit()
         return device
     
     def add_to_queue(self, session, hostname, ip_address):
-        """Add a device to the processing queue"""
-        queue_item = Queue(
-            hostname=hostname,
-            ip_address=ip_address
-        )
-        session.add(queue_item)
-        session.commit()
-        return queue_item
+        """Add a device to the processing queue, returning False if it was already queued (committed by the caller)"""
+        return bool(self.add_to_queue_bulk(session, [(hostname, ip_address)]))
     
-    def mark_processing(self, session, hostname):
-        """Mark a device as being processed"""
-        queue_item = session.query(Queue).filter_by(hostname=hostname).first()
-        if queue_item:
-            queue_item.is_processing = True
-            session.commit()
-            return True
-        return False
+    def add_to_queue_bulk(self, session, devices):
+        """Queue (hostname, ip_address) pairs in one INSERT, returning the pairs that were new (committed by the caller)"""
+        if not devices:
+            return []
+        return session.execute(
+            self._queue_insert,
+            [{'hostname': hostname, 'ip_address': ip_address} for hostname, ip_address in devices]
+        ).all()
     
-    def mark_processed(self, session, hostname):
-        """Mark a device as processed"""
-        queue_item = session.query(Queue).filter_by(hostname=hostname).first()
-        if queue_item:
-            queue_item.is_processed = True
-            queue_item.is_processing = False
-            queue_item.processed_at = datetime.utcnow()
-            session.commit()
-            return True
-        return False
+    def mark_processed_bulk(self, session, queue_ids):
+        """Mark many queued devices as processed in one UPDATE (committed by the caller)"""
+        if not queue_ids:
+            return
+        session.execute(
+            update(Queue)
+            .where(Queue.id.in_(queue_ids))
+            .values(is_processed=True, is_processing=False, processed_at=datetime.utcnow())
+        )
+    
+    def release_claims(self, session, queue_ids):
+        """Return claimed but unprocessed devices to the pending pool (committed by the caller)"""
+        session.execute(
+            update(Queue)
+            .where(Queue.id.in_(queue_ids), Queue.is_processed == false())
+            .values(is_processing=False)
+        )
     
-    def get_next_device(self, session):
-        """Get the next unprocessed device from the queue"""
-        return session.query(Queue).filter_by(
-            is_processed=False,
-            is_processing=False
-        ).first()
+    def count_pending(self, session):
+        """Count queued devices not yet claimed by the dispatcher"""
+        # Same predicate as ix_queue_pending, so SQLite counts the partial index
+        return session.execute(
+            select(func.count()).select_from(Queue).where(
+                Queue.is_processed == false(),
+                Queue.is_processing == false()
+            )
+        ).scalar()
     
-    def device_exists(self, session, hostname=None, ip_address=None):
-        """Check if a device exists in either the devices or queue table"""
-        if hostname:
-            device = session.query(Device).filter_by(hostname=hostname).first()
-            if device:
-                return True
-            queue_item = session.query(Queue).filter_by(hostname=hostname).first()
-            if queue_item:
-                return True
-        if ip_address:
-            device = session.query(Device).filter_by(ip_address=ip_address).first()
-            if device:
-                return True
-            queue_item = session.query(Queue).filter_by(ip_address=ip_address).first()
-            if queue_item:
-                return True
-        return False 
\ No newline at end of file
+    def claim_next_devices(self, session, limit):
+        """Atomically claim up to limit of the oldest pending devices as (id, hostname, ip_address) rows"""
+        pending = select(Queue.id).where(
+            Queue.is_processed == false(),
+            Queue.is_processing == false()
+        ).order_by(Queue.id).limit(limit)
+        claimed = session.execute(
+            update(Queue)
+            .where(Queue.id.in_(pending))
+            .values(is_processing=True)
+            .returning(Queue.id, Queue.hostname, Queue.ip_address)
+        ).all()
+        # RETURNING order is unspecified, so restore queue order here
+        claimed.sort()
+        return claimed
@@ -1,36 +1,66 @@
 import logging
 import re
-from typing import Dict, List, Optional
-import yaml
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from settings import config
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load configuration
-with open('config.yaml', 'r') as f:
-    config = yaml.safe_load(f)
+_SERIAL_RE = re.compile(r'\s*\(Serial:.*\)')
+
+def _normalize_hostname(hostname: str) -> str:
+    """Normalize hostname by removing FQDN and serial number annotations"""
+    # Remove FQDN
+    hostname = hostname.partition('.')[0]
+    
+    # Remove serial number annotations, skipping the regex when there are none
+    if '(Serial:' in hostname:
+        hostname = _SERIAL_RE.sub('', hostname)
+    
+    return hostname.strip().lower()
+
+# Classification rules as (regex, device type) in priority order: exclude
+# patterns, then the Cisco platform tokens, then include patterns (which
+# classify as themselves)
+_PLATFORM_RULES = (
+    [(re.escape(pattern.lower()), 'excluded') for pattern in config['filtering']['exclude_platforms']]
+    + [(r'nx-os|nexus', 'cisco_nxos'),
+       (r'ios[- ]xe', 'cisco_xe'),
+       (r'ios', 'cisco_ios')]
+    + [(re.escape(pattern.lower()), pattern) for pattern in config['filtering']['include_platforms']]
+)
+_PLATFORM_TYPES = tuple(device_type for _, device_type in _PLATFORM_RULES)
+
+# One group per rule inside a lookahead, so a single scan reports a hit at every
+# position, overlapping or not. Where several rules start at the same position
+# the alternation picks the highest priority one, so the lowest group number
+# seen across the scan is the rule the old loop-per-pattern checks would pick.
+_PLATFORM_RE = re.compile(
+    '(?=(?:' + '|'.join(f'({regex})' for regex, _ in _PLATFORM_RULES) + '))'
+)
+
+# Device types that are not crawlable network infrastructure
+_NON_INFRA = frozenset({'excluded', 'unknown'})
+
+@lru_cache(maxsize=4096)
+def _classify(platform_lower: str) -> Tuple[str, bool]:
+    """Map a lower-cased platform string to (device type, is infrastructure)"""
+    hits = [match.lastindex for match in _PLATFORM_RE.finditer(platform_lower)]
+    device_type = _PLATFORM_TYPES[min(hits) - 1] if hits else 'unknown'
+    return device_type, device_type not in _NON_INFRA
 
 class NetworkDevice:
+    # Fixed attributes, so each device carries no per-instance __dict__
+    __slots__ = ('hostname', 'ip_address', 'platform', 'serial_number', 'device_type', 'raw_data')
+    
     def __init__(self, hostname: str, ip_address: str):
-        self.hostname = self._normalize_hostname(hostname)
+        self.hostname = _normalize_hostname(hostname)
         self.ip_address = ip_address
         self.platform = None
         self.serial_number = None
         self.device_type = None
         self.raw_data = {}
         
-    @staticmethod
-    def _normalize_hostname(hostname: str) -> str:
-        """Normalize hostname by removing FQDN and serial number annotations"""
-        # Remove FQDN
-        hostname = hostname.split('.')[0]
-        
-        # Remove serial number annotations
-        hostname = re.sub(r'\s*\(Serial:.*\)', '', hostname)
-        
-        return hostname.strip().lower()
-    
     def update_from_show_version(self, data: Dict) -> None:
         """Update device information from show version output"""
         self.platform = data.get('platform', '')
@@ -48,31 +78,11 @@ class NetworkDevice:
         
     def _determine_device_type(self) -> str:
         """Determine device type based on platform string"""
-        platform_lower = self.platform.lower()
-        
-        # Check exclude patterns first
-        for pattern in config['filtering']['exclude_platforms']:
-            if pattern.lower() in platform_lower:
-                return 'excluded'
-                
-        # Check for specific Cisco platforms
-        if 'nx-os' in platform_lower or 'nexus' in platform_lower:
-            return 'cisco_nxos'
-        elif 'ios-xe' in platform_lower or 'ios xe' in platform_lower:
-            return 'cisco_xe'
-        elif 'ios' in platform_lower:
-            return 'cisco_ios'
-            
-        # Check include patterns
-        for pattern in config['filtering']['include_platforms']:
-            if pattern.lower() in platform_lower:
-                return pattern
-                
-        return 'unknown'
+        return _classify(self.platform.lower())[0]
     
     def is_infrastructure_device(self) -> bool:
         """Check if this is an infrastructure device based on platform"""
-        return self.device_type != 'excluded' and self.device_type != 'unknown'
+        return self.device_type not in _NON_INFRA
     
     def to_dict(self) -> Dict:
         """Convert device information to dictionary"""
@@ -95,18 +105,12 @@ class NetworkDevice:
             if not neighbor.get('ip_address'):
                 continue
                 
-            # Create temporary device to check if it's infrastructure
-            temp_device = NetworkDevice(
-                hostname=neighbor.get('hostname', ''),
-                ip_address=neighbor.get('ip_address', '')
-            )
-            temp_device.platform = neighbor.get('platform', '')
-            temp_device.device_type = temp_device._determine_device_type()
-            
-            if temp_device.is_infrastructure_device():
+            # Classify directly rather than building a throwaway NetworkDevice
+            _, is_infra = _classify(neighbor.get('platform', '').lower())
+            if is_infra:
                 neighbors.append({
-                    'hostname': temp_device.hostname,
-                    'ip_address': temp_device.ip_address
+                    'hostname': _normalize_hostname(neighbor.get('hostname', '')),
+                    'ip_address': neighbor['ip_address']
                 })
                 
         return neighbors 
\ No newline at end of file
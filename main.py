@@ -1,11 +1,13 @@
 import argparse
 import logging
-import os
 import sys
 from crawler import NetworkCrawler
-import yaml
 
-# Configure logging
+# Configure logging once for the whole crawler. Thread and process details
+# aren't in the format, so skip looking them up for every record.
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -24,7 +26,7 @@ def main():
     
     try:
         # Create crawler instance
-        crawler = NetworkCrawler(args.username, args.password)
+        crawler = NetworkCrawler(args.username, args.password, args.workers)
         
         # Add seed device
         crawler.add_seed_device(args.seed_hostname, args.seed_ip)
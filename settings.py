@@ -0,0 +1,27 @@
+import os
+from functools import lru_cache
+import yaml
+
+# Resolved next to the code so the crawler can be started from any directory
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yaml')
+
+# The libyaml-backed loader is much faster; fall back when PyYAML was built without it
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+@lru_cache(maxsize=1)
+def get_config() -> dict:
+    """Load and parse config.yaml once for every module that needs it"""
+    with open(CONFIG_PATH, 'rb') as f:
+        return yaml.load(f, Loader=_Loader)
+
+config = get_config()
+
+# Settings read in hot paths, flattened out of the nested config
+MAX_WORKERS = config['threading']['max_workers']
+QUEUE_TIMEOUT = config['threading']['queue_timeout']
+QUEUED_PER_WORKER = config['threading'].get('queued_per_worker', 2)
+PARSE_PROCESSES = config['threading'].get('parse_processes')
+TIMEOUT = config['connection']['timeout']
+RETRY_ATTEMPTS = config['connection']['retry_attempts']
+RETRY_DELAY = config['connection']['retry_delay']
+PROBE_TIMEOUT = config['connection'].get('probe_timeout', 2)